@@ -1,24 +1,30 @@
 # tile_proxy_service.py
 import asyncio
-import aiohttp
+import concurrent.futures
+import multiprocessing
+import hashlib
+import httpx
 import redis.asyncio as redis
-from fastapi import FastAPI, HTTPException, Response, Query
+from fastapi import FastAPI, HTTPException, Response, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, ORJSONResponse
 import os
 import json
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, Any, Awaitable, Callable
 import logging
 from contextlib import asynccontextmanager
 import time
 import traceback
 from PIL import Image
+import numpy as np
 import io
 import random
+from collections import Counter
+from cachetools import LRUCache, TTLCache
 
-# Setup detailed logging
+# Setup logging; quiet by default in production, opt into INFO/DEBUG via LOG_LEVEL
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "WARNING").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -27,11 +33,14 @@ logger.info("Starting tile proxy service...")
 # Global variables for shared resources
 redis_client = None
 http_session = None
+cache_write_queue = None
+cache_writer_task = None
+warmup_task = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifecycle"""
-    global redis_client, http_session
+    global redis_client, http_session, cache_write_queue, cache_writer_task, warmup_task
     
     logger.info("Starting application startup...")
     
@@ -40,15 +49,22 @@ async def lifespan(app: FastAPI):
         redis_url = os.getenv("REDIS_URL", "redis://redis:6379/0")
         logger.info(f"Connecting to Redis at: {redis_url}")
         
+        # redis-py picks the hiredis C parser automatically when installed.
+        # Use a blocking pool so bursts beyond the cap wait for a free
+        # connection instead of failing with "Too many connections".
+        pool = redis.BlockingConnectionPool.from_url(
+            redis_url,
+            decode_responses=False,
+            socket_connect_timeout=5,
+            socket_timeout=5,
+            max_connections=config.redis_max_connections,
+            timeout=config.redis_pool_timeout
+        )
+        redis_client = redis.Redis(connection_pool=pool)
+        
         max_retries = 5
         for attempt in range(max_retries):
             try:
-                redis_client = redis.from_url(
-                    redis_url,
-                    decode_responses=False,
-                    socket_connect_timeout=5,
-                    socket_timeout=5
-                )
                 # Test connection
                 await redis_client.ping()
                 logger.info("Redis connection successful")
@@ -57,24 +73,49 @@ async def lifespan(app: FastAPI):
                 logger.warning(f"Redis connection attempt {attempt + 1}/{max_retries} failed: {e}")
                 if attempt == max_retries - 1:
                     logger.error("Could not connect to Redis, continuing without cache")
+                    await pool.disconnect()
                     redis_client = None
                 else:
                     await asyncio.sleep(2)
         
-        # HTTP session with connection pooling
+        # Background writer batching cache writes into pipelines
+        if redis_client:
+            cache_write_queue = asyncio.Queue(maxsize=config.cache_write_queue_size)
+            cache_writer_task = asyncio.create_task(cache_writer())
+            
+            # Preload the most requested tiles into memory without delaying startup
+            warmup_task = asyncio.create_task(warm_memory_cache())
+        
+        # HTTP client with connection pooling and HTTP/2 multiplexing. This single client
+        # is shared by all requests; never create a client per request or pooling is lost.
         logger.info("Setting up HTTP session...")
-        connector = aiohttp.TCPConnector(
-            limit=100,
-            limit_per_host=20,
-            keepalive_timeout=30
+        limits = httpx.Limits(
+            max_connections=config.http_conn_limit,
+            max_keepalive_connections=config.http_keepalive_connections,
+            keepalive_expiry=config.http_keepalive_expiry
         )
-        timeout = aiohttp.ClientTimeout(total=15, connect=5)
-        http_session = aiohttp.ClientSession(
-            connector=connector,
-            timeout=timeout,
+        http_session = httpx.AsyncClient(
+            http2=True,
+            limits=limits,
+            timeout=httpx.Timeout(config.http_timeout, connect=5.0),
+            follow_redirects=True,
             headers={'User-Agent': 'TileProxy/2.0'}
         )
         
+        # Process pool for CPU-bound tile compositing, kept off the event loop. Use
+        # forkserver so workers don't inherit this process's sockets and threads, and
+        # start them now rather than on the first composite request.
+        app.state.pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=config.composite_workers,
+            mp_context=multiprocessing.get_context("forkserver")
+        )
+        # Workers spawn on demand, so keep each busy briefly to force a new one per job
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(app.state.pool, time.sleep, 0.1)
+            for _ in range(config.composite_workers)
+        ])
+        
         logger.info("Tile proxy service started successfully")
         
     except Exception as e:
@@ -87,10 +128,19 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("Shutting down...")
     try:
+        if warmup_task and not warmup_task.done():
+            warmup_task.cancel()
+        if cache_writer_task:
+            # Let the writer flush what is still queued
+            await cache_write_queue.put(None)
+            await cache_writer_task
         if http_session:
-            await http_session.close()
+            await http_session.aclose()
+        if getattr(app.state, "pool", None):
+            app.state.pool.shutdown(wait=True, cancel_futures=True)
         if redis_client:
-            await redis_client.close()
+            # The pool was passed in explicitly, so it isn't closed by default
+            await redis_client.close(close_connection_pool=True)
         logger.info("Tile proxy service stopped")
     except Exception as e:
         logger.error(f"Error during shutdown: {e}")
@@ -99,7 +149,8 @@ app = FastAPI(
     title="Tile Proxy Service",
     description="High-performance tile proxy with caching and compositing",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -126,9 +177,71 @@ class TileConfig:
         self.thunderforest_key = os.getenv("THUNDERFOREST_API_KEY", "")
         self.cache_ttl = int(os.getenv("CACHE_TTL", "864000"))  # 10 days default
         self.max_tile_size = int(os.getenv("MAX_TILE_SIZE", "1048576"))  # 1MB default
+        self.redis_max_connections = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
+        self.redis_pool_timeout = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))  # seconds to wait for a connection
+        self.http_conn_limit = int(os.getenv("HTTP_CONN_LIMIT", "1000"))
+        self.http_keepalive_connections = int(os.getenv("HTTP_KEEPALIVE_CONNECTIONS", "200"))
+        self.http_keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "120"))  # seconds
+        self.http_timeout = float(os.getenv("HTTP_TIMEOUT", "15"))  # seconds, whole request
+        self.mem_cache_bytes = int(os.getenv("MEM_CACHE_BYTES", "67108864"))  # 64MB default
+        self.mem_cache_ttl = int(os.getenv("MEM_CACHE_TTL", "300"))  # 5 minutes default
+        self.mem_cache_max_item_size = int(os.getenv("MEM_CACHE_MAX_ITEM_SIZE", "262144"))  # 256KB default
+        # Bytes per compositing worker; total is this x COMPOSITE_WORKERS x uvicorn workers
+        self.decoded_cache_size = int(os.getenv("DECODED_CACHE_SIZE", "16777216"))  # 16MB default
+        self.cache_write_batch_size = int(os.getenv("CACHE_WRITE_BATCH_SIZE", "64"))
+        self.cache_write_flush_interval = float(os.getenv("CACHE_WRITE_FLUSH_INTERVAL", "0.01"))  # seconds
+        self.cache_write_queue_size = int(os.getenv("CACHE_WRITE_QUEUE_SIZE", "10000"))
+        self.warmup_tiles = int(os.getenv("WARMUP_TILES", "1024"))
+        self.popularity_max_size = int(os.getenv("POPULARITY_MAX_SIZE", "100000"))
+        self.popularity_flush_interval = float(os.getenv("POPULARITY_FLUSH_INTERVAL", "1"))  # seconds
+        self.popularity_decay_interval = int(os.getenv("POPULARITY_DECAY_INTERVAL", "3600"))  # seconds
+        # Per uvicorn worker, so keep it small (the image runs 4 uvicorn workers)
+        self.composite_workers = int(os.getenv("COMPOSITE_WORKERS", "2"))
+        # Favour fast encoding over smaller output for per-request composites (use 3 as a middle ground)
+        self.png_compress_level = int(os.getenv("PNG_COMPRESS_LEVEL", "1"))
 
 config = TileConfig()
 
+# In-process cache in front of Redis for the hottest tiles, bounded by total tile bytes
+TILE_MEM_CACHE = TTLCache(maxsize=config.mem_cache_bytes, ttl=config.mem_cache_ttl, getsizeof=len)
+
+# Decoded RGBA pixels of recent composite layers, keyed by a digest of their PNG bytes
+# and bounded by pixel bytes. Lives in each compositing worker process so hot layers
+# skip PNG decoding; jobs go to any free worker, so each sees only part of the hits.
+DECODED_TILE_CACHE = LRUCache(maxsize=config.decoded_cache_size, getsizeof=lambda pixels: pixels.nbytes)
+
+# Redis sorted set counting cache hits per cache key, used to warm the memory cache.
+# Hits are counted in-process and flushed by the cache writer.
+POPULARITY_KEY = "tile:popularity"
+POPULARITY_DECAY_KEY = "tile:popularity:decay"
+POPULARITY_COUNTS: Counter = Counter()
+
+# In-flight loads by cache key so concurrent misses for the same tile only hit upstream once
+INFLIGHT: dict[str, asyncio.Task] = {}
+
+# Static tile response headers, shared across requests (copied before adding the ETag)
+_HIT_HEADERS = {
+    "Cache-Control": "public, max-age=864000, immutable",
+    "X-Cache": "HIT",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
+    "Access-Control-Allow-Headers": "*"
+}
+_MISS_HEADERS = {**_HIT_HEADERS, "X-Cache": "MISS"}
+_FALLBACK_HEADERS = {**_MISS_HEADERS, "Cache-Control": "no-store"}
+
+def tile_etag(cache_key: str) -> str:
+    """ETag derived from the cache key; tile content is immutable per URL"""
+    return '"' + hashlib.blake2b(cache_key.encode(), digest_size=8).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag (weak comparison)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
 def get_tile_format(style: str) -> Tuple[str, str]:
     """Get tile format and media type based on style"""
     # Vector tiles (PBF format)
@@ -138,35 +251,48 @@ def get_tile_format(style: str) -> Tuple[str, str]:
     else:
         return "png", "image/png"
 
+def build_style_templates() -> dict[str, str]:
+    """Build URL templates for every known style, leaving z/x/y/lang to fill in"""
+    # Keys are baked into templates that go through str.format, so escape any braces
+    # (twice for Jawg, whose templates are formatted once here and once per request)
+    jawg_key = config.jawg_key.replace("{", "{{{{").replace("}", "}}}}")
+    thunderforest_key = config.thunderforest_key.replace("{", "{{").replace("}", "}}")
+    
+    jawg_url = "https://tile.jawg.io/{style}/{{z}}/{{x}}/{{y}}@1x.png?access-token=" + jawg_key + "&lang={{lang}}"
+    jawg_vector_url = "https://tile.jawg.io/{style}/{{z}}/{{x}}/{{y}}.pbf?access-token=" + jawg_key
+    thunderforest_url = "https://tile.thunderforest.com/transport/{z}/{x}/{y}.png?apikey=" + thunderforest_key
+    osm_url = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+    
+    templates = {}
+    for style in ["jawg-streets", "jawg-lagoon", "jawg-sunny", "jawg-light", "jawg-terrain", "jawg-dark"]:
+        templates[style] = jawg_url.format(style=style)
+    for style in ["streets-v2+landcover-v1.1+hillshade-v1", "streets-v2"]:
+        templates[style] = jawg_vector_url.format(style=style)
+    templates["thunderforest-transport"] = thunderforest_url
+    templates["osm"] = osm_url
+    return templates
+
+STYLE_TEMPLATES = build_style_templates()
+
 def build_tile_url(style: str, z: int, x: int, y: int, lang: str = "int") -> Optional[str]:
     """Build tile URL based on style"""
     
-    # URL templates
-    jawg_url = f"https://tile.jawg.io/{style}/{z}/{x}/{y}@1x.png?access-token={config.jawg_key}&lang={lang}"
-    jawg_vector_url = f"https://tile.jawg.io/{style}/{z}/{x}/{y}.pbf?access-token={config.jawg_key}"
-    thunderforest_url = f"https://tile.thunderforest.com/transport/{z}/{x}/{y}.png?apikey={config.thunderforest_key}"
-    osm_url = f"https://tile.openstreetmap.org/{z}/{x}/{y}.png"
-    
     # OpenRailwayMap overlays
     if style.startswith("openrailwaymap-"):
         orm_type = style.replace("openrailwaymap-", "")
         subdomain = random.choice(['a', 'b', 'c'])
         return f"https://{subdomain}.tiles.openrailwaymap.org/{orm_type}/{z}/{x}/{y}.png"
     
-    style_mapping = {
-        "jawg-streets": jawg_url,
-        "jawg-lagoon": jawg_url,
-        "jawg-sunny": jawg_url,
-        "jawg-light": jawg_url,
-        "jawg-terrain": jawg_url,
-        "jawg-dark": jawg_url,
-        "streets-v2+landcover-v1.1+hillshade-v1": jawg_vector_url,
-        "streets-v2": jawg_vector_url,
-        "thunderforest-transport": thunderforest_url,
-        "osm":osm_url
-    }
-    
-    return style_mapping.get(style)
+    template = STYLE_TEMPLATES.get(style)
+    if template:
+        return template.format(z=z, x=x, y=y, lang=lang)
+    return None
+
+def get_cache_key(style: str, z: int, x: int, y: int, lang: str, tile_format: str) -> str:
+    """Build cache key for a single (non-composite) tile"""
+    if tile_format == "pbf":
+        return f"tile:{style}:{z}:{x}:{y}:{tile_format}"
+    return f"tile:{style}:{z}:{x}:{y}:{lang}:{tile_format}"
 
 async def get_cached_tile(cache_key: str) -> Optional[bytes]:
     """Get tile from Redis cache"""
@@ -176,95 +302,241 @@ async def get_cached_tile(cache_key: str) -> Optional[bytes]:
     try:
         cached_data = await redis_client.get(cache_key)
         if cached_data:
-            logger.info(f"Cache hit: {cache_key}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Cache hit: %s", cache_key)
             return cached_data
     except Exception as e:
         logger.error(f"Cache read error: {e}")
     return None
 
-async def cache_tile(cache_key: str, tile_data: bytes, ttl: int = None):
-    """Cache tile in Redis"""
+async def get_cached_tiles(cache_keys: List[str]) -> List[Optional[bytes]]:
+    """Get several tiles from Redis cache with a single MGET"""
     if not redis_client:
+        return [None] * len(cache_keys)
+        
+    try:
+        return await redis_client.mget(cache_keys)
+    except Exception as e:
+        logger.error(f"Cache read error: {e}")
+    return [None] * len(cache_keys)
+
+async def cache_tile(cache_key: str, tile_data: bytes, ttl: int = None):
+    """Queue tile for caching in Redis"""
+    if not redis_client or not cache_write_queue:
         return
         
     try:
         ttl = ttl or config.cache_ttl
-        await redis_client.setex(cache_key, ttl, tile_data)
-        logger.info(f"Cached tile: {cache_key} (TTL: {ttl}s)")
+        cache_write_queue.put_nowait((cache_key, ttl, tile_data))
+    except asyncio.QueueFull:
+        logger.warning(f"Cache write queue full, dropping: {cache_key}")
+
+def count_hit(cache_key: str):
+    """Count a cache hit; counts are flushed to Redis by the cache writer"""
+    if cache_write_queue is not None:
+        POPULARITY_COUNTS[cache_key] += 1
+
+async def flush_cache_writes(batch: List[Tuple[str, int, bytes]]):
+    """Write a batch of tiles and pending hit counts to Redis in a single round trip"""
+    counts = POPULARITY_COUNTS.copy()
+    POPULARITY_COUNTS.clear()
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for cache_key, ttl, tile_data in batch:
+                pipe.setex(cache_key, ttl, tile_data)
+            if counts:
+                for cache_key, hits in counts.items():
+                    pipe.zincrby(POPULARITY_KEY, hits, cache_key)
+                # Keep only the most requested keys in the popularity set
+                pipe.zremrangebyrank(POPULARITY_KEY, 0, -config.popularity_max_size - 1)
+            await pipe.execute()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Cached %d tiles, counted %d hit keys", len(batch), len(counts))
     except Exception as e:
         logger.error(f"Cache write error: {e}")
 
+async def decay_popularity():
+    """Halve popularity scores so recent hits outweigh old ones"""
+    try:
+        # Only one worker per interval gets to decay
+        if await redis_client.set(POPULARITY_DECAY_KEY, 1, nx=True, ex=config.popularity_decay_interval):
+            await redis_client.zunionstore(POPULARITY_KEY, {POPULARITY_KEY: 0.5})
+    except Exception as e:
+        logger.error(f"Popularity decay error: {e}")
+
+async def cache_writer():
+    """Drain the cache write queue into pipelined batches until a None sentinel"""
+    loop = asyncio.get_running_loop()
+    next_decay = loop.time()
+    stopping = False
+    
+    while not stopping:
+        if loop.time() >= next_decay:
+            await decay_popularity()
+            next_decay = loop.time() + config.popularity_decay_interval
+        
+        # Wake up periodically so hit counts get flushed even without tile writes
+        try:
+            item = await asyncio.wait_for(cache_write_queue.get(), config.popularity_flush_interval)
+        except asyncio.TimeoutError:
+            if POPULARITY_COUNTS:
+                await flush_cache_writes([])
+            continue
+        if item is None:
+            if POPULARITY_COUNTS:
+                await flush_cache_writes([])
+            break
+        batch = [item]
+        
+        # Collect more writes until the batch is full or the flush interval expires
+        deadline = loop.time() + config.cache_write_flush_interval
+        while len(batch) < config.cache_write_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(cache_write_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        
+        await flush_cache_writes(batch)
+
+async def warm_memory_cache():
+    """Load the most requested tiles from Redis into the memory cache"""
+    try:
+        cache_keys = await redis_client.zrevrange(POPULARITY_KEY, 0, config.warmup_tiles - 1)
+        
+        # Read them back in pipelined MGET chunks
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for i in range(0, len(cache_keys), 256):
+                pipe.mget(cache_keys[i:i + 256])
+            chunks = await pipe.execute()
+        
+        warmed = 0
+        for cache_key, tile_data in zip(cache_keys, (tile for chunk in chunks for tile in chunk)):
+            if tile_data:
+                remember_tile(cache_key.decode(), tile_data)
+                warmed += 1
+        logger.info(f"Warmed memory cache with {warmed} tiles")
+    except Exception as e:
+        logger.error(f"Cache warmup error: {e}")
+
+def remember_tile(cache_key: str, tile_data: bytes):
+    """Keep tile in the in-process memory cache"""
+    # Don't let a single oversized tile evict many small ones
+    if len(tile_data) <= config.mem_cache_max_item_size:
+        TILE_MEM_CACHE[cache_key] = tile_data
+
+async def single_flight(cache_key: str, load: Callable[[], Awaitable[Any]]) -> Any:
+    """Run load() once per cache_key; concurrent callers await the same result"""
+    task = INFLIGHT.get(cache_key)
+    if task is None:
+        # Run the load as its own task so no single request's cancellation can abort it
+        task = asyncio.ensure_future(load())
+        INFLIGHT[cache_key] = task
+        task.add_done_callback(lambda _: INFLIGHT.pop(cache_key, None))
+        # Mark errors as retrieved so asyncio doesn't warn when every caller has gone
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    
+    # Shield so a disconnecting caller (leader included) doesn't cancel the shared load
+    return await asyncio.shield(task)
+
 async def fetch_tile_from_source(url: str, tile_format: str) -> tuple[int, Optional[bytes], Optional[str]]:
     """Fetch tile from external source"""
     try:
-        async with http_session.get(url) as response:
-            if response.status == 200:
-                content = await response.read()
-                
-                # Validate tile size
-                if len(content) > config.max_tile_size:
-                    logger.warning(f"Tile too large: {len(content)} bytes")
+        # httpx timeouts apply per read/write; also cap the whole request like aiohttp's total did
+        async with asyncio.timeout(config.http_timeout), http_session.stream("GET", url) as response:
+            if response.status_code == 200:
+                # Reject oversized tiles up front when the size is announced
+                content_length = int(response.headers.get('Content-Length') or 0)
+                if content_length > config.max_tile_size:
+                    logger.warning(f"Tile too large: {content_length} bytes")
                     return 413, None, None  # Payload too large
                 
+                # Stream the body so we never buffer more than max_tile_size
+                content = bytearray()
+                async for chunk in response.aiter_bytes(16384):
+                    content.extend(chunk)
+                    if len(content) > config.max_tile_size:
+                        logger.warning(f"Tile too large: more than {config.max_tile_size} bytes")
+                        return 413, None, None  # Payload too large
+                
                 # Get content encoding from response
                 content_encoding = response.headers.get('Content-Encoding')
                     
-                return 200, content, content_encoding
+                return 200, bytes(content), content_encoding
             else:
-                logger.warning(f"Upstream error: {response.status} for {url}")
-                return response.status, None, None
+                logger.warning(f"Upstream error: {response.status_code} for {url}")
+                return response.status_code, None, None
                 
-    except asyncio.TimeoutError:
+    except (httpx.TimeoutException, asyncio.TimeoutError):
         logger.error(f"Timeout fetching: {url}")
         return 504, None, None
     except Exception as e:
         logger.error(f"Error fetching {url}: {e}")
         return 500, None, None
 
-async def composite_tiles(base_tile: bytes, overlay_tile: bytes) -> bytes:
-    """Composite two PNG tiles together"""
-    try:
-        # Open both images
-        base_img = Image.open(io.BytesIO(base_tile))
-        overlay_img = Image.open(io.BytesIO(overlay_tile))
-        
-        # Log dimensions for debugging
-        logger.info(f"Base image size: {base_img.size}, mode: {base_img.mode}")
-        logger.info(f"Overlay image size: {overlay_img.size}, mode: {overlay_img.mode}")
-        
-        # Ensure both images are in RGBA mode
-        if base_img.mode != 'RGBA':
-            base_img = base_img.convert('RGBA')
-        if overlay_img.mode != 'RGBA':
-            overlay_img = overlay_img.convert('RGBA')
-        
-        # Resize if dimensions don't match (tiles should be 256x256)
-        if base_img.size != overlay_img.size:
-            # Standard tile size
-            target_size = (256, 256)
-            
-            # Resize both to standard size if needed
-            if base_img.size != target_size:
-                logger.warning(f"Resizing base image from {base_img.size} to {target_size}")
-                base_img = base_img.resize(target_size, Image.Resampling.LANCZOS)
-            
-            if overlay_img.size != target_size:
-                logger.warning(f"Resizing overlay image from {overlay_img.size} to {target_size}")
-                overlay_img = overlay_img.resize(target_size, Image.Resampling.LANCZOS)
-        
-        # Create a new image for compositing
-        composite = Image.new('RGBA', base_img.size, (0, 0, 0, 0))
-        
-        # Paste base image first
-        composite.paste(base_img, (0, 0))
+def _decode_tile(tile_data: bytes) -> np.ndarray:
+    """Decode PNG tile to RGBA pixels, reusing recently decoded layers (runs in a worker process)"""
+    digest = hashlib.blake2b(tile_data, digest_size=16).digest()
+    pixels = DECODED_TILE_CACHE.get(digest)
+    if pixels is None:
+        img = Image.open(io.BytesIO(tile_data))
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        pixels = np.asarray(img, dtype=np.uint8)
+        if pixels.nbytes <= config.decoded_cache_size:
+            DECODED_TILE_CACHE[digest] = pixels
+    return pixels
+
+def _resize_pixels(pixels: np.ndarray, target_size: Tuple[int, int]) -> np.ndarray:
+    """Resize RGBA pixels to target_size (width, height)"""
+    img = Image.fromarray(pixels, 'RGBA').resize(target_size, Image.Resampling.LANCZOS)
+    return np.asarray(img, dtype=np.uint8)
+
+def _composite_sync(base_tile: bytes, overlay_tile: bytes) -> bytes:
+    """Composite two PNG tiles together (runs in a worker process)"""
+    base = _decode_tile(base_tile)
+    overlay = _decode_tile(overlay_tile)
+    
+    # Resize if dimensions don't match (tiles should be 256x256)
+    if base.shape != overlay.shape:
+        # Standard tile size
+        target_size = (256, 256)
         
-        # Paste overlay with alpha channel
-        composite.paste(overlay_img, (0, 0), overlay_img)
+        # Resize both to standard size if needed
+        if base.shape[:2] != target_size:
+            logger.warning(f"Resizing base image from {base.shape[1::-1]} to {target_size}")
+            base = _resize_pixels(base, target_size)
         
-        # Save to bytes
-        output = io.BytesIO()
-        composite.save(output, format='PNG', optimize=True)
-        return output.getvalue()
+        if overlay.shape[:2] != target_size:
+            logger.warning(f"Resizing overlay image from {overlay.shape[1::-1]} to {target_size}")
+            overlay = _resize_pixels(overlay, target_size)
+    
+    # Alpha blend overlay onto base with vectorized NumPy ops, accumulating in place
+    # and writing straight into the output to avoid extra full-tile temporaries
+    alpha = overlay[..., 3:4].astype(np.uint16)
+    blend = overlay[..., :3] * alpha
+    blend += base[..., :3] * (255 - alpha)
+    blend += 127
+    composite = np.empty_like(base)
+    np.floor_divide(blend, 255, out=composite[..., :3], casting='unsafe')
+    np.maximum(base[..., 3], overlay[..., 3], out=composite[..., 3])
+    
+    # Save to bytes; skip optimize's filter search and max deflate, encoding runs per request
+    output = io.BytesIO()
+    Image.fromarray(composite, 'RGBA').save(output, format='PNG', compress_level=config.png_compress_level, optimize=False)
+    return output.getvalue()
+
+async def composite_tiles(base_tile: bytes, overlay_tile: bytes) -> bytes:
+    """Composite two PNG tiles together in the process pool"""
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(app.state.pool, _composite_sync, base_tile, overlay_tile)
         
     except Exception as e:
         logger.error(f"Error compositing tiles: {e}")
@@ -272,71 +544,57 @@ async def composite_tiles(base_tile: bytes, overlay_tile: bytes) -> bytes:
         logger.error(f"Overlay tile size: {len(overlay_tile)} bytes")
         raise
 
-@app.get("/tile/{style}/{x}/{y}/{z}")
-@app.get("/tile/{style}/{x}/{y}/{z}/{lang}")
-async def get_tile(
-    style: str, 
-    z: int, 
-    x: int, 
-    y: int,
-    lang: str = "int",
-    base_style: Optional[str] = Query(None, description="Base style for OpenRailwayMap overlay compositing")
-):
-    """Get tile with caching and optional compositing for OpenRailwayMap overlays"""
-    
-    # Validate zoom level (prevent abuse)
-    if not (0 <= z <= 20):
-        raise HTTPException(status_code=400, detail="Invalid zoom level")
-    
-    # Check if this is an OpenRailwayMap overlay request with compositing
-    is_orm_composite = style.startswith("openrailwaymap-") and base_style is not None
-    
-    # Get tile format and media type
-    tile_format, media_type = get_tile_format(style)
-    
-    # Create cache key
-    if is_orm_composite:
-        cache_key = f"tile:composite:{base_style}+{style}:{z}:{x}:{y}:{lang}"
-    elif tile_format == "pbf":
-        cache_key = f"tile:{style}:{z}:{x}:{y}:{tile_format}"
-    else:
-        cache_key = f"tile:{style}:{z}:{x}:{y}:{lang}:{tile_format}"
+async def get_layer_tile(url: str, cache_key: str, cached_data: Optional[bytes] = None) -> tuple[int, Optional[bytes]]:
+    """Get one layer of a composite tile, using the cached value already looked up if any"""
+    if cached_data:
+        remember_tile(cache_key, cached_data)
+        return 200, cached_data
     
-    # Try cache first
-    cached_tile = await get_cached_tile(cache_key)
-    if cached_tile:
-        return Response(
-            content=cached_tile,
-            media_type=media_type,
-            headers={
-                "Cache-Control": "public, max-age=864000",
-                "X-Cache": "HIT",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
-                "Access-Control-Allow-Headers": "*"
-            }
-        )
+    status_code, tile_data, _ = await fetch_tile_from_source(url, "png")
+    if status_code == 200 and tile_data:
+        # Layers are cached on their own so other composites can reuse them
+        await cache_tile(cache_key, tile_data)
+        remember_tile(cache_key, tile_data)
+    return status_code, tile_data
+
+async def fetch_tile(
+    style: str,
+    z: int,
+    x: int,
+    y: int,
+    lang: str,
+    tile_format: str,
+    base_style: Optional[str] = None,
+    cached_layers: Tuple[Optional[bytes], Optional[bytes]] = (None, None)
+) -> Tuple[bytes, bool]:
+    """Fetch tile from upstream, compositing over base_style when given.
+    Returns the tile and whether it is complete (False for a base-only fallback)."""
+    complete = True
     
     # Handle composite tiles (OpenRailwayMap overlay + base map)
-    if is_orm_composite:
-        # Fetch base tile
+    if base_style is not None:
         base_url = build_tile_url(base_style, z, x, y, lang)
         if not base_url:
             raise HTTPException(status_code=400, detail=f"Unknown base tile style: {base_style}")
         
-        base_status, base_data, _ = await fetch_tile_from_source(base_url, "png")
-        if base_status != 200 or not base_data:
-            raise HTTPException(status_code=base_status or 404, detail="Could not fetch base tile")
-        
-        # Fetch overlay tile
         overlay_url = build_tile_url(style, z, x, y, lang)
         if not overlay_url:
             raise HTTPException(status_code=400, detail=f"Unknown overlay tile style: {style}")
         
-        overlay_status, overlay_data, _ = await fetch_tile_from_source(overlay_url, "png")
+        # Fetch missing base and overlay tiles concurrently
+        cached_base, cached_overlay = cached_layers
+        (base_status, base_data), (overlay_status, overlay_data) = await asyncio.gather(
+            get_layer_tile(base_url, get_cache_key(base_style, z, x, y, lang, "png"), cached_base),
+            get_layer_tile(overlay_url, get_cache_key(style, z, x, y, lang, "png"), cached_overlay)
+        )
+        if base_status != 200 or not base_data:
+            raise HTTPException(status_code=base_status or 404, detail="Could not fetch base tile")
+        
         if overlay_status != 200 or not overlay_data:
-            # If overlay doesn't exist, return just the base tile
+            # If overlay doesn't exist, return just the base tile; any other
+            # failure is transient, so the base-only tile must not be kept
             tile_data = base_data
+            complete = overlay_status == 404
         else:
             # Composite the tiles
             try:
@@ -345,6 +603,7 @@ async def get_tile(
                 logger.error(f"Compositing failed: {e}")
                 # Fall back to base tile on compositing error
                 tile_data = base_data
+                complete = False
     else:
         # Regular single tile fetch
         tile_url = build_tile_url(style, z, x, y, lang)
@@ -359,17 +618,108 @@ async def get_tile(
                 detail=f"Could not fetch tile for style {style}"
             )
     
+    return tile_data, complete
+
+async def load_tile(
+    cache_key: str,
+    style: str,
+    z: int,
+    x: int,
+    y: int,
+    lang: str,
+    tile_format: str,
+    base_style: Optional[str] = None
+) -> Tuple[bytes, bool, bool]:
+    """Load tile from Redis or upstream, returning the tile, whether it was a cache hit
+    and whether it is complete (False for a degraded composite that must not be cached)"""
+    if base_style is not None:
+        # Composites aren't stored in Redis; only their layers are, and they are
+        # composited per request. Check memory first, then look up the remaining
+        # layers in one round trip.
+        layer_keys = [
+            get_cache_key(base_style, z, x, y, lang, "png"),
+            get_cache_key(style, z, x, y, lang, "png")
+        ]
+        cached_layers = [TILE_MEM_CACHE.get(key) for key in layer_keys]
+        missing = [i for i, layer in enumerate(cached_layers) if layer is None]
+        if missing:
+            found = await get_cached_tiles([layer_keys[i] for i in missing])
+            for i, layer in zip(missing, found):
+                cached_layers[i] = layer
+        tile_data, complete = await fetch_tile(style, z, x, y, lang, tile_format, base_style, tuple(cached_layers))
+        if complete:
+            remember_tile(cache_key, tile_data)
+        return tile_data, all(cached_layers), complete
+    
+    cached_tile = await get_cached_tile(cache_key)
+    if cached_tile:
+        remember_tile(cache_key, cached_tile)
+        return cached_tile, True, True
+    
+    tile_data, _ = await fetch_tile(style, z, x, y, lang, tile_format)
+    
     # Cache the tile
     await cache_tile(cache_key, tile_data)
+    remember_tile(cache_key, tile_data)
+    return tile_data, False, True
+
+@app.get("/tile/{style}/{x}/{y}/{z}")
+@app.get("/tile/{style}/{x}/{y}/{z}/{lang}")
+async def get_tile(
+    style: str, 
+    z: int, 
+    x: int, 
+    y: int,
+    lang: str = "int",
+    base_style: Optional[str] = Query(None, description="Base style for OpenRailwayMap overlay compositing"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Get tile with caching and optional compositing for OpenRailwayMap overlays"""
     
-    # Prepare headers
-    headers = {
-        "Cache-Control": "public, max-age=864000",
-        "X-Cache": "MISS",
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
-        "Access-Control-Allow-Headers": "*"
-    }
+    # Validate zoom level (prevent abuse)
+    if not (0 <= z <= 20):
+        raise HTTPException(status_code=400, detail="Invalid zoom level")
+    
+    # Check if this is an OpenRailwayMap overlay request with compositing
+    is_orm_composite = style.startswith("openrailwaymap-") and base_style is not None
+    
+    # Get tile format and media type
+    tile_format, media_type = get_tile_format(style)
+    
+    # Create cache key
+    if is_orm_composite:
+        cache_key = f"tile:composite:{base_style}+{style}:{z}:{x}:{y}:{lang}"
+    else:
+        cache_key = get_cache_key(style, z, x, y, lang, tile_format)
+    
+    # Client already has this tile; answer before touching any cache or upstream
+    etag = tile_etag(cache_key)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={**_HIT_HEADERS, "ETag": etag})
+    
+    # Try memory cache, then Redis, then upstream
+    tile_data = TILE_MEM_CACHE.get(cache_key)
+    cache_hit = tile_data is not None
+    complete = True
+    if not cache_hit:
+        tile_data, cache_hit, complete = await single_flight(
+            cache_key,
+            lambda: load_tile(cache_key, style, z, x, y, lang, tile_format, base_style if is_orm_composite else None)
+        )
+    
+    if cache_hit:
+        if is_orm_composite:
+            # Composites aren't in Redis, so credit the layers warmup can load
+            count_hit(get_cache_key(base_style, z, x, y, lang, "png"))
+            count_hit(get_cache_key(style, z, x, y, lang, "png"))
+        else:
+            count_hit(cache_key)
+    
+    # A degraded composite must not be cached or validated against the real tile's ETag
+    if not complete:
+        headers = _FALLBACK_HEADERS
+    else:
+        headers = {**(_HIT_HEADERS if cache_hit else _MISS_HEADERS), "ETag": etag}
     
     return Response(
         content=tile_data,
@@ -377,6 +727,13 @@ async def get_tile(
         headers=headers
     )
 
+# Environment never changes at runtime, so build the health block once
+HEALTH_ENVIRONMENT = {
+    "redis_url": os.getenv("REDIS_URL", "redis://redis:6379/0"),
+    "has_jawg_key": bool(os.getenv("JAWG_API_KEY")),
+    "has_thunderforest_key": bool(os.getenv("THUNDERFOREST_API_KEY"))
+}
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -384,11 +741,7 @@ async def health_check():
         "status": "healthy",
         "timestamp": time.time(),
         "cache": "disconnected",
-        "environment": {
-            "redis_url": os.getenv("REDIS_URL", "redis://redis:6379/0"),
-            "has_jawg_key": bool(os.getenv("JAWG_API_KEY")),
-            "has_thunderforest_key": bool(os.getenv("THUNDERFOREST_API_KEY"))
-        }
+        "environment": HEALTH_ENVIRONMENT
     }
     
     try:
@@ -420,6 +773,13 @@ async def cache_stats():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def unlink_keys(keys: List[bytes]) -> int:
+    """Unlink keys in one pipelined round trip; memory is reclaimed by Redis in the background"""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.unlink(*keys)
+        results = await pipe.execute()
+    return sum(results)
+
 @app.delete("/cache/clear")
 async def clear_cache():
     """Clear tile cache (admin endpoint)"""
@@ -427,11 +787,22 @@ async def clear_cache():
         if not redis_client:
             raise HTTPException(status_code=503, detail="Redis not connected")
             
-        # Only clear tile keys
-        keys = await redis_client.keys("tile:*")
-        if keys:
-            await redis_client.delete(*keys)
-            return {"message": f"Cleared {len(keys)} cached tiles"}
+        # Only clear tile keys, scanning incrementally instead of blocking on KEYS
+        cleared = 0
+        batch = []
+        async for key in redis_client.scan_iter(match="tile:*", count=1000):
+            batch.append(key)
+            if len(batch) >= 512:
+                cleared += await unlink_keys(batch)
+                batch = []
+        if batch:
+            cleared += await unlink_keys(batch)
+        
+        # Drop in-process copies too
+        TILE_MEM_CACHE.clear()
+        
+        if cleared:
+            return {"message": f"Cleared {cleared} cached tiles"}
         return {"message": "No tiles to clear"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -444,5 +815,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
-        access_log=True
+        loop="uvloop",
+        http="httptools",
+        access_log=os.getenv("LOG_ACCESS", "false").lower() == "true"
     )
\ No newline at end of file